@@ -5,6 +5,26 @@
 
 import re
 
+# Символы markdown, которых не должно остаться после очистки
+MARKDOWN_SYMBOLS = frozenset("*#`[]>|~")
+
+
+def find_markdown_symbols(text: str) -> frozenset:
+    """
+    Найти оставшиеся markdown символы в тексте.
+
+    Пересечение множеств выполняется за один проход на уровне C,
+    без посимвольного цикла в Python.
+
+    Args:
+        text: Проверяемый текст
+
+    Returns:
+        frozenset: Найденные markdown символы
+    """
+    return MARKDOWN_SYMBOLS.intersection(text)
+
+
 def clean_markdown(text: str) -> str:
     """
     Очистить текст от markdown символов и правильно отформатировать.
@@ -102,6 +122,9 @@ def test_markdown_cleanup():
     print("=" * 50)
     print(cleaned_text)
     print("\n" + "=" * 50)
+
+    found_symbols = find_markdown_symbols(cleaned_text)
+    assert not found_symbols, f"Остались markdown символы: {found_symbols}"
     
     # Дополнительные тесты
     additional_tests = [
@@ -118,7 +141,9 @@ def test_markdown_cleanup():
     for i, test in enumerate(additional_tests, 1):
         print(f"Тест {i}:")
         print(f"Исходный: {test}")
-        print(f"Очищенный: {clean_markdown(test)}")
+        cleaned = clean_markdown(test)
+        print(f"Очищенный: {cleaned}")
+        print(f"Markdown символы: {find_markdown_symbols(cleaned) or 'нет'}")
         print("-" * 30)
 
 
@@ -169,7 +169,7 @@ def _parse_allowed_origins() -> List[str]:
         return ["http://localhost:3000"]
 
 
-@lru_cache()
+@lru_cache(maxsize=1)
 def get_settings() -> Settings:
     """
     Получение настроек приложения с кэшированием.
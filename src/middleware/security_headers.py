@@ -3,16 +3,92 @@ Security Headers Middleware для добавления заголовков б
 Реализует OWASP рекомендации по безопасности веб-приложений.
 """
 
+import asyncio
+import ipaddress
+import socket
 import time
-from typing import Callable
-
-from fastapi import Request, Response
-from starlette.middleware.base import BaseHTTPMiddleware
-
-
-class SecurityHeadersMiddleware(BaseHTTPMiddleware):
+from collections import OrderedDict, deque
+from functools import lru_cache
+from typing import Any, Deque, Dict, Iterable, List, Optional, Tuple, Union
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Период обновления грубых часов DDoS защиты в секундах
+CLOCK_TICK_INTERVAL = 1.0
+
+# Период фоновой очистки старых записей DDoS защиты в секундах
+CLEANUP_INTERVAL = 60.0
+
+# Соседние заблокированные сети сворачиваются не шире этого префикса
+MIN_COLLAPSE_PREFIX = 16
+
+# Сколько адресов из заблокированных сетей держать в LRU кэше
+BLOCK_CACHE_SIZE = 1024
+
+# Узел IPTrie: потомки по ключам 0 и 1 и время окончания блокировки по "expires"
+TrieNode = Dict[Union[int, str], Any]
+
+# Разобранный IPv4 или IPv6 адрес
+IPAddress = Union[ipaddress.IPv4Address, ipaddress.IPv6Address]
+
+# Дефолтная Content Security Policy
+DEFAULT_CSP_POLICY = (
+    "default-src 'self'; "
+    "script-src 'self' 'unsafe-inline' 'unsafe-eval'; "
+    "style-src 'self' 'unsafe-inline'; "
+    "img-src 'self' data: https:; "
+    "font-src 'self'; "
+    "connect-src 'self'; "
+    "media-src 'self'; "
+    "object-src 'none'; "
+    "child-src 'none'; "
+    "frame-ancestors 'none'; "
+    "form-action 'self'; "
+    "base-uri 'self'; "
+    "manifest-src 'self'"
+)
+
+# Дефолтная Permissions Policy
+DEFAULT_PERMISSIONS_POLICY = (
+    "geolocation=(), "
+    "microphone=(), "
+    "camera=(), "
+    "payment=(), "
+    "usb=(), "
+    "magnetometer=(), "
+    "accelerometer=(), "
+    "gyroscope=(), "
+    "speaker=(), "
+    "vibrate=(), "
+    "fullscreen=(self), "
+    "sync-xhr=()"
+)
+
+
+@lru_cache(maxsize=65536)
+def _ipv4_to_int(ip: str) -> Optional[int]:
+    """Преобразует IPv4 адрес в число, для остальных адресов возвращает None."""
+    try:
+        return int.from_bytes(socket.inet_pton(socket.AF_INET, ip), "big")
+    except OSError:
+        return None
+
+
+@lru_cache(maxsize=65536)
+def _parse_ip(ip: str) -> Optional[IPAddress]:
+    """Разбирает IPv4 или IPv6 адрес, для некорректной строки возвращает None."""
+    try:
+        return ipaddress.ip_address(ip)
+    except ValueError:
+        return None
+
+
+class SecurityHeadersMiddleware:
     """
-    Middleware для добавления заголовков безопасности к HTTP ответам.
+    ASGI middleware для добавления заголовков безопасности к HTTP ответам.
+
+    Заголовки дописываются в сообщение http.response.start, тело ответа
+    проходит без буферизации.
 
     Добавляет следующие заголовки:
     - Strict-Transport-Security (HSTS)
@@ -25,9 +101,26 @@ class SecurityHeadersMiddleware(BaseHTTPMiddleware):
     - X-Permitted-Cross-Domain-Policies
     """
 
+    __slots__ = (
+        "app",
+        "hsts_max_age",
+        "hsts_include_subdomains",
+        "hsts_preload",
+        "frame_options",
+        "content_type_options",
+        "xss_protection",
+        "referrer_policy",
+        "cross_domain_policy",
+        "csp_policy",
+        "permissions_policy",
+        "_static_headers",
+        "_hsts_header",
+        "_replaced_headers",
+    )
+
     def __init__(
         self,
-        app,
+        app: ASGIApp,
         hsts_max_age: int = 31536000,  # 1 год
         hsts_include_subdomains: bool = True,
         hsts_preload: bool = True,
@@ -43,7 +136,7 @@ class SecurityHeadersMiddleware(BaseHTTPMiddleware):
         Инициализация middleware с настройками безопасности.
 
         Args:
-            app: FastAPI приложение
+            app: Следующее ASGI приложение в цепочке
             hsts_max_age: Время действия HSTS в секундах
             hsts_include_subdomains: Включать поддомены в HSTS
             hsts_preload: Включить preload для HSTS
@@ -55,7 +148,7 @@ class SecurityHeadersMiddleware(BaseHTTPMiddleware):
             permissions_policy: Кастомная Permissions Policy
             cross_domain_policy: Политика X-Permitted-Cross-Domain-Policies
         """
-        super().__init__(app)
+        self.app = app
         self.hsts_max_age = hsts_max_age
         self.hsts_include_subdomains = hsts_include_subdomains
         self.hsts_preload = hsts_preload
@@ -65,116 +158,190 @@ class SecurityHeadersMiddleware(BaseHTTPMiddleware):
         self.referrer_policy = referrer_policy
         self.cross_domain_policy = cross_domain_policy
 
-        # Дефолтная Content Security Policy
-        if csp_policy is None:
-            self.csp_policy = (
-                "default-src 'self'; "
-                "script-src 'self' 'unsafe-inline' 'unsafe-eval'; "
-                "style-src 'self' 'unsafe-inline'; "
-                "img-src 'self' data: https:; "
-                "font-src 'self'; "
-                "connect-src 'self'; "
-                "media-src 'self'; "
-                "object-src 'none'; "
-                "child-src 'none'; "
-                "frame-ancestors 'none'; "
-                "form-action 'self'; "
-                "base-uri 'self'; "
-                "manifest-src 'self'"
-            )
-        else:
-            self.csp_policy = csp_policy
-
-        # Дефолтная Permissions Policy
-        if permissions_policy is None:
-            self.permissions_policy = (
-                "geolocation=(), "
-                "microphone=(), "
-                "camera=(), "
-                "payment=(), "
-                "usb=(), "
-                "magnetometer=(), "
-                "accelerometer=(), "
-                "gyroscope=(), "
-                "speaker=(), "
-                "vibrate=(), "
-                "fullscreen=(self), "
-                "sync-xhr=()"
-            )
-        else:
-            self.permissions_policy = permissions_policy
-
-    async def dispatch(self, request: Request, call_next: Callable) -> Response:
+        # Политики по умолчанию собраны один раз при импорте модуля
+        self.csp_policy = DEFAULT_CSP_POLICY if csp_policy is None else csp_policy
+        self.permissions_policy = (
+            DEFAULT_PERMISSIONS_POLICY
+            if permissions_policy is None
+            else permissions_policy
+        )
+
+        # Заголовки не меняются между запросами, поэтому кодируются один раз
+        self._static_headers = self._build_static_headers()
+        self._hsts_header = self._build_hsts_header()
+
+        # Заголовки ответа приложения, которые заменяются или удаляются
+        self._replaced_headers = frozenset(name for name, _ in self._static_headers) | {
+            b"strict-transport-security",
+            b"server",
+            b"x-powered-by",
+        }
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
         """
         Обработка запроса и добавление заголовков безопасности.
 
         Args:
-            request: HTTP запрос
-            call_next: Следующий middleware в цепочке
-
-        Returns:
-            Response: HTTP ответ с добавленными заголовками безопасности
+            scope: ASGI scope запроса
+            receive: Канал получения сообщений
+            send: Канал отправки сообщений
         """
-        # Обрабатываем запрос
-        response = await call_next(request)
-
-        # Добавляем заголовки безопасности
-        self._add_security_headers(request, response)
-
-        return response
-
-    def _add_security_headers(self, request: Request, response: Response) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        is_https = scope.get("scheme") == "https"
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                # Убираем заголовки сервера и перекрываемые значения приложения,
+                # затем дописываем готовый список заголовков безопасности
+                headers = [
+                    header
+                    for header in message.get("headers", ())
+                    if header[0].lower() not in self._replaced_headers
+                ]
+                headers.extend(self._static_headers)
+                if is_https:
+                    headers.append(self._hsts_header)
+                message["headers"] = headers
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+    def _build_static_headers(self) -> List[Tuple[bytes, bytes]]:
         """
-        Добавляет заголовки безопасности к ответу.
+        Собирает заголовки безопасности, одинаковые для всех ответов.
 
-        Args:
-            request: HTTP запрос
-            response: HTTP ответ
+        Returns:
+            List[Tuple[bytes, bytes]]: Имена и значения заголовков в ASGI формате
         """
-        # HSTS (HTTP Strict Transport Security)
-        if request.url.scheme == "https":
-            hsts_value = f"max-age={self.hsts_max_age}"
-            if self.hsts_include_subdomains:
-                hsts_value += "; includeSubDomains"
-            if self.hsts_preload:
-                hsts_value += "; preload"
-            response.headers["Strict-Transport-Security"] = hsts_value
+        return [
+            # X-Frame-Options - защита от clickjacking
+            (b"x-frame-options", self.frame_options.encode("latin-1")),
+            # X-Content-Type-Options - предотвращение MIME sniffing
+            (b"x-content-type-options", self.content_type_options.encode("latin-1")),
+            # X-XSS-Protection - защита от XSS (устаревший, но для совместимости)
+            (b"x-xss-protection", self.xss_protection.encode("latin-1")),
+            # Referrer-Policy - контроль передачи referrer
+            (b"referrer-policy", self.referrer_policy.encode("latin-1")),
+            # Content-Security-Policy - защита от XSS и injection атак
+            (b"content-security-policy", self.csp_policy.encode("latin-1")),
+            # Permissions-Policy - контроль доступа к API браузера
+            (b"permissions-policy", self.permissions_policy.encode("latin-1")),
+            # X-Permitted-Cross-Domain-Policies - контроль Flash/PDF политик
+            (
+                b"x-permitted-cross-domain-policies",
+                self.cross_domain_policy.encode("latin-1"),
+            ),
+            # Кастомный заголовок для идентификации
+            (b"x-security-headers", b"enabled"),
+        ]
 
-        # X-Frame-Options - защита от clickjacking
-        response.headers["X-Frame-Options"] = self.frame_options
+    def _build_hsts_header(self) -> Tuple[bytes, bytes]:
+        """Собирает HSTS заголовок, который добавляется только для HTTPS."""
+        hsts_value = f"max-age={self.hsts_max_age}"
+        if self.hsts_include_subdomains:
+            hsts_value += "; includeSubDomains"
+        if self.hsts_preload:
+            hsts_value += "; preload"
+        return (b"strict-transport-security", hsts_value.encode("latin-1"))
 
-        # X-Content-Type-Options - предотвращение MIME sniffing
-        response.headers["X-Content-Type-Options"] = self.content_type_options
 
-        # X-XSS-Protection - защита от XSS (устаревший, но для совместимости)
-        response.headers["X-XSS-Protection"] = self.xss_protection
+class IPTrie:
+    """
+    Бинарное префиксное дерево заблокированных IPv4 сетей.
 
-        # Referrer-Policy - контроль передачи referrer
-        response.headers["Referrer-Policy"] = self.referrer_policy
+    Узел — словарь с потомками по ключам 0 и 1 и необязательным ключом
+    "expires" со временем окончания блокировки. Адрес заблокирован, если
+    блокировка действует на любом узле по пути от корня, поэтому поиск
+    проходит не больше 32 бит адреса.
+    """
 
-        # Content-Security-Policy - защита от XSS и injection атак
-        response.headers["Content-Security-Policy"] = self.csp_policy
+    __slots__ = ("_root",)
 
-        # Permissions-Policy - контроль доступа к API браузера
-        response.headers["Permissions-Policy"] = self.permissions_policy
+    def __init__(self) -> None:
+        """Создает пустое дерево."""
+        self._root: TrieNode = {}
 
-        # X-Permitted-Cross-Domain-Policies - контроль Flash/PDF политик
-        cross_domain_header = "X-Permitted-Cross-Domain-Policies"
-        response.headers[cross_domain_header] = self.cross_domain_policy
+    def __bool__(self) -> bool:
+        """Дерево непустое, если в нем есть хотя бы одна сеть."""
+        return bool(self._root)
 
-        # Удаляем потенциально опасные заголовки сервера
-        if "Server" in response.headers:
-            del response.headers["Server"]
-        if "X-Powered-By" in response.headers:
-            del response.headers["X-Powered-By"]
+    def insert(self, network: int, prefix_len: int, expires: float) -> None:
+        """
+        Блокирует сеть до указанного времени.
 
-        # Добавляем кастомный заголовок для идентификации
-        response.headers["X-Security-Headers"] = "enabled"
+        Args:
+            network: Адрес сети числом
+            prefix_len: Длина префикса сети в битах
+            expires: Время окончания блокировки
+        """
+        node = self._root
+        for shift in range(31, 31 - prefix_len, -1):
+            node = node.setdefault((network >> shift) & 1, {})
+        node["expires"] = max(node.get("expires", 0.0), expires)
 
+    def lookup(self, ip: int, current_time: float) -> Optional[float]:
+        """
+        Ищет действующую блокировку сети, в которую входит адрес.
 
-class DDoSProtectionMiddleware(BaseHTTPMiddleware):
+        Returns:
+            Время окончания блокировки или None, если адрес не заблокирован
+        """
+        node = self._root
+        for shift in range(31, -1, -1):
+            child: Optional[TrieNode] = node.get((ip >> shift) & 1)
+            if child is None:
+                return None
+            node = child
+            expires: float = node.get("expires", 0.0)
+            if expires > current_time:
+                return expires
+        return None
+
+    def contains(self, ip: int, current_time: float) -> bool:
+        """Проверяет, входит ли адрес в действующую заблокированную сеть."""
+        return self.lookup(ip, current_time) is not None
+
+    def prune(self, current_time: float) -> None:
+        """Удаляет истекшие блокировки и сворачивает соседние сети в общую."""
+        self._prune_node(self._root, 0, current_time)
+
+    def _prune_node(self, node: TrieNode, depth: int, current_time: float) -> bool:
+        """Чистит поддерево и возвращает True, если узел стал пустым."""
+        if node.get("expires", current_time + 1) <= current_time:
+            del node["expires"]
+
+        for bit in (0, 1):
+            child = node.get(bit)
+            if child is not None and self._prune_node(child, depth + 1, current_time):
+                del node[bit]
+
+        # Обе половины сети заблокированы: блокируем всю сеть до более
+        # раннего из сроков, более поздний срок остается у своей половины
+        zero, one = node.get(0), node.get(1)
+        if (
+            depth >= MIN_COLLAPSE_PREFIX
+            and zero is not None
+            and one is not None
+            and "expires" in zero
+            and "expires" in one
+        ):
+            expires = min(zero["expires"], one["expires"])
+            node["expires"] = max(node.get("expires", 0.0), expires)
+            for bit, child in ((0, zero), (1, one)):
+                if child["expires"] <= node["expires"]:
+                    del child["expires"]
+                    if not child:
+                        del node[bit]
+
+        return not node
+
+
+class DDoSProtectionMiddleware:
     """
-    Базовая защита от DDoS атак на уровне приложения.
+    Базовая защита от DDoS атак на уровне приложения (ASGI middleware).
 
     Реализует:
     - Ограничение количества одновременных соединений с одного IP
@@ -182,98 +349,217 @@ class DDoSProtectionMiddleware(BaseHTTPMiddleware):
     - Временная блокировка подозрительных IP
     """
 
+    __slots__ = (
+        "app",
+        "max_connections_per_ip",
+        "suspicious_threshold",
+        "block_duration",
+        "whitelist_ips",
+        "whitelist_networks",
+        "subnet_block_threshold",
+        "_window",
+        "ip_connections",
+        "ip_requests",
+        "blocked_ips",
+        "blocked_networks",
+        "_subnet_blocks",
+        "_block_cache",
+        "last_cleanup",
+        "_current_time",
+        "_ticker",
+        "_cleanup_task",
+        "_blocked_headers",
+        "_rate_limited_headers",
+    )
+
+    # Тела ответов 429 не меняются и не сериализуются на каждый отказ
+    _BLOCKED_BODY = b"Too Many Requests - IP temporarily blocked"
+    _RATE_LIMITED_BODY = b"Too Many Requests"
+
     def __init__(
         self,
-        app,
+        app: ASGIApp,
         max_connections_per_ip: int = 10,
         suspicious_threshold: int = 100,
         block_duration: int = 300,  # 5 минут
-        whitelist_ips: list = None,
+        whitelist_ips: Optional[Iterable[str]] = None,
+        subnet_block_threshold: int = 16,
     ):
         """
         Инициализация DDoS защиты.
 
         Args:
-            app: FastAPI приложение
+            app: Следующее ASGI приложение в цепочке
             max_connections_per_ip: Максимум соединений с одного IP
             suspicious_threshold: Порог подозрительной активности
             block_duration: Время блокировки в секундах
-            whitelist_ips: Список доверенных IP адресов
+            whitelist_ips: Доверенные IP адреса и сети в нотации CIDR;
+                коллекция строк, одиночная строка не принимается
+            subnet_block_threshold: Сколько IP одной /24 сети заблокировать,
+                прежде чем заблокировать всю сеть
         """
-        super().__init__(app)
+        self.app = app
         self.max_connections_per_ip = max_connections_per_ip
         self.suspicious_threshold = suspicious_threshold
         self.block_duration = block_duration
-        self.whitelist_ips = whitelist_ips or []
+        # Точные адреса проверяются по множеству, сети — только при промахе
+        if isinstance(whitelist_ips, str):
+            raise TypeError("whitelist_ips должен быть коллекцией, а не строкой")
+        whitelist = list(whitelist_ips or ())
+        self.whitelist_ips = frozenset(ip for ip in whitelist if "/" not in ip)
+        self.whitelist_networks = [
+            ipaddress.ip_network(network, strict=False)
+            for network in whitelist
+            if "/" in network
+        ]
+        if subnet_block_threshold < 1:
+            raise ValueError("subnet_block_threshold должен быть не меньше 1")
+        self.subnet_block_threshold = subnet_block_threshold
 
-        # Счетчики и блокировки
+        # Счетчики и блокировки. Для каждого IP хранятся только последние
+        # suspicious_threshold + 1 меток времени, более старые вытесняются
+        self._window = suspicious_threshold + 1
         self.ip_connections = {}
-        self.ip_requests = {}
+        self.ip_requests: Dict[str, Deque[float]] = {}
         self.blocked_ips = {}
+        self.blocked_networks = IPTrie()
+        self._subnet_blocks: Dict[int, int] = {}
+        self._block_cache: "OrderedDict[str, float]" = OrderedDict()
         self.last_cleanup = time.time()
 
-    async def dispatch(self, request: Request, call_next: Callable) -> Response:
+        # Грубые часы: время обновляется фоновой задачей раз в секунду,
+        # чтобы не вызывать time.time() на каждом запросе
+        self._current_time = time.time()
+        self._ticker: Optional["asyncio.Task[None]"] = None
+        self._cleanup_task: Optional["asyncio.Task[None]"] = None
+
+        # Заголовки ответов 429 собираются один раз
+        self._blocked_headers = self._build_reject_headers(
+            self._BLOCKED_BODY, str(block_duration), "DDoS Protection"
+        )
+        self._rate_limited_headers = self._build_reject_headers(
+            self._RATE_LIMITED_BODY, "60", "Rate Limit Exceeded"
+        )
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
         """
         Обработка запроса с проверкой DDoS защиты.
 
         Args:
-            request: HTTP запрос
-            call_next: Следующий middleware в цепочке
-
-        Returns:
-            Response: HTTP ответ или блокировка
+            scope: ASGI scope запроса
+            receive: Канал получения сообщений
+            send: Канал отправки сообщений
         """
-        client_ip = self._get_client_ip(request)
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        if self._ticker is None or self._ticker.done():
+            self._start_background_tasks()
 
-        # Очистка старых записей каждые 60 секунд
-        current_time = time.time()
-        if current_time - self.last_cleanup > 60:
-            self._cleanup_old_records(current_time)
-            self.last_cleanup = current_time
+        client_ip = self._get_client_ip(scope)
+        current_time = self._current_time
 
         # Проверяем whitelist
-        if client_ip in self.whitelist_ips:
-            return await call_next(request)
+        if self._is_whitelisted(client_ip):
+            await self.app(scope, receive, send)
+            return
 
         # Проверяем блокировку
         if self._is_ip_blocked(client_ip, current_time):
-            return Response(
-                content="Too Many Requests - IP temporarily blocked",
-                status_code=429,
-                headers={
-                    "Retry-After": str(self.block_duration),
-                    "X-Block-Reason": "DDoS Protection",
-                },
-            )
+            await self._reject(send, self._blocked_headers, self._BLOCKED_BODY)
+            return
 
         # Проверяем лимиты
         if self._check_rate_limits(client_ip, current_time):
-            return Response(
-                content="Too Many Requests",
-                status_code=429,
-                headers={"Retry-After": "60", "X-Block-Reason": "Rate Limit Exceeded"},
+            await self._reject(
+                send, self._rate_limited_headers, self._RATE_LIMITED_BODY
             )
+            return
 
         # Обновляем счетчики
         self._update_counters(client_ip, current_time)
 
         # Обрабатываем запрос
-        response = await call_next(request)
-
-        return response
+        await self.app(scope, receive, send)
+
+    @staticmethod
+    def _build_reject_headers(
+        body: bytes, retry_after: str, reason: str
+    ) -> List[Tuple[bytes, bytes]]:
+        """Собирает заголовки ответа 429 в ASGI формате."""
+        return [
+            (b"content-type", b"text/plain; charset=utf-8"),
+            (b"content-length", str(len(body)).encode("latin-1")),
+            (b"retry-after", retry_after.encode("latin-1")),
+            (b"x-block-reason", reason.encode("latin-1")),
+        ]
 
-    def _get_client_ip(self, request: Request) -> str:
+    @staticmethod
+    async def _reject(
+        send: Send, headers: List[Tuple[bytes, bytes]], body: bytes
+    ) -> None:
+        """Отправляет готовый ответ 429 напрямую ASGI сообщениями."""
+        await send(
+            {"type": "http.response.start", "status": 429, "headers": list(headers)}
+        )
+        await send({"type": "http.response.body", "body": body})
+
+    def _start_background_tasks(self) -> None:
+        """Запускает грубые часы и очистку старых записей в текущем event loop."""
+        self._current_time = time.time()
+        self._ticker = asyncio.create_task(self._tick())
+        if self._cleanup_task is None or self._cleanup_task.done():
+            self._cleanup_task = asyncio.create_task(self._cleanup_loop())
+
+    async def _tick(self) -> None:
+        """Обновляет закэшированное время раз в CLOCK_TICK_INTERVAL секунд."""
+        while True:
+            await asyncio.sleep(CLOCK_TICK_INTERVAL)
+            self._current_time = time.time()
+
+    async def _cleanup_loop(self) -> None:
+        """Раз в CLEANUP_INTERVAL секунд очищает старые записи вне запросов."""
+        while True:
+            await asyncio.sleep(CLEANUP_INTERVAL)
+            self._cleanup_old_records(self._current_time)
+            self.last_cleanup = self._current_time
+
+    def _get_client_ip(self, scope: Scope) -> str:
         """Получает реальный IP клиента с учетом proxy."""
-        # Проверяем заголовки от reverse proxy
-        forwarded_for = request.headers.get("X-Forwarded-For")
+        # Один проход по сырым заголовкам, имена в ASGI уже в нижнем регистре
+        forwarded_for: Optional[bytes] = None
+        real_ip: Optional[bytes] = None
+        for name, value in scope["headers"]:
+            if name == b"x-forwarded-for":
+                if forwarded_for is None:
+                    forwarded_for = value
+            elif name == b"x-real-ip":
+                if real_ip is None:
+                    real_ip = value
+
+        # Заголовки от reverse proxy, декодируется только итоговый IP
         if forwarded_for:
-            return forwarded_for.split(",")[0].strip()
+            comma = forwarded_for.find(b",")
+            token = forwarded_for[:comma] if comma >= 0 else forwarded_for
+            return token.strip().decode("latin-1")
 
-        real_ip = request.headers.get("X-Real-IP")
         if real_ip:
-            return real_ip
+            return real_ip.decode("latin-1")
+
+        client = scope.get("client")
+        return client[0] if client else "unknown"
 
-        return request.client.host if request.client else "unknown"
+    def _is_whitelisted(self, ip: str) -> bool:
+        """Проверяет, входит ли IP в доверенные адреса или сети."""
+        if ip in self.whitelist_ips:
+            return True
+
+        if self.whitelist_networks:
+            address = _parse_ip(ip)
+            if address is not None:
+                return any(address in network for network in self.whitelist_networks)
+        return False
 
     def _is_ip_blocked(self, ip: str, current_time: float) -> bool:
         """Проверяет, заблокирован ли IP."""
@@ -284,56 +570,87 @@ class DDoSProtectionMiddleware(BaseHTTPMiddleware):
             else:
                 # Разблокируем IP
                 del self.blocked_ips[ip]
+
+        # Адреса, недавно найденные в заблокированных сетях, отвечают из
+        # небольшого LRU кэша без обхода дерева
+        expires = self._block_cache.get(ip)
+        if expires is not None:
+            if expires > current_time:
+                self._block_cache.move_to_end(ip)
+                return True
+            del self._block_cache[ip]
+
+        # Сети проверяются, только если заблокирована хотя бы одна
+        if self.blocked_networks:
+            ip_int = _ipv4_to_int(ip)
+            if ip_int is not None:
+                expires = self.blocked_networks.lookup(ip_int, current_time)
+                if expires is not None:
+                    self._block_cache[ip] = expires
+                    if len(self._block_cache) > BLOCK_CACHE_SIZE:
+                        self._block_cache.popitem(last=False)
+                    return True
         return False
 
+    def _block_ip(self, ip: str, current_time: float) -> None:
+        """Блокирует IP, а при частых блокировках в его /24 сети — всю сеть."""
+        self.blocked_ips[ip] = current_time
+
+        ip_int = _ipv4_to_int(ip)
+        if ip_int is None:
+            return
+
+        prefix = ip_int >> 8
+        hits = self._subnet_blocks.get(prefix, 0) + 1
+        if hits >= self.subnet_block_threshold:
+            self.blocked_networks.insert(
+                prefix << 8, 24, current_time + self.block_duration
+            )
+            self._subnet_blocks.pop(prefix, None)
+        else:
+            self._subnet_blocks[prefix] = hits
+
     def _check_rate_limits(self, ip: str, current_time: float) -> bool:
         """Проверяет превышение лимитов запросов."""
         # Проверяем whitelist
-        if ip in self.whitelist_ips:
+        if self._is_whitelisted(ip):
             return False
 
-        # Проверяем количество запросов за последнюю минуту
-        if ip in self.ip_requests:
-            recent_requests = [
-                req_time
-                for req_time in self.ip_requests[ip]
-                if current_time - req_time < 60
-            ]
-
-            if len(recent_requests) > self.suspicious_threshold:
+        # Если самая старая из последних suspicious_threshold + 1 меток
+        # моложе минуты, порог за последнюю минуту превышен
+        timestamps = self.ip_requests.get(ip)
+        if timestamps is not None and len(timestamps) == self._window:
+            if current_time - timestamps[0] < 60:
                 # Блокируем IP
-                self.blocked_ips[ip] = current_time
+                self._block_ip(ip, current_time)
                 return True
 
         return False
 
     def _update_counters(self, ip: str, current_time: float) -> None:
         """Обновляет счетчики запросов."""
-        if ip not in self.ip_requests:
-            self.ip_requests[ip] = []
+        timestamps = self.ip_requests.get(ip)
+        if timestamps is None:
+            timestamps = self.ip_requests[ip] = deque(maxlen=self._window)
 
-        self.ip_requests[ip].append(current_time)
-
-        # Оставляем только запросы за последний час
-        self.ip_requests[ip] = [
-            req_time
-            for req_time in self.ip_requests[ip]
-            if current_time - req_time < 3600
-        ]
+        # При заполнении очереди самая старая метка вытесняется автоматически
+        timestamps.append(current_time)
 
     def _cleanup_old_records(self, current_time: float) -> None:
         """Очищает старые записи для экономии памяти."""
-        # Очищаем старые запросы (старше часа)
+        # Удаляем IP без запросов за последний час: достаточно проверить
+        # самую свежую метку
         for ip in list(self.ip_requests.keys()):
-            self.ip_requests[ip] = [
-                req_time
-                for req_time in self.ip_requests[ip]
-                if current_time - req_time < 3600
-            ]
-            if not self.ip_requests[ip]:
+            timestamps = self.ip_requests[ip]
+            if not timestamps or current_time - timestamps[-1] >= 3600:
                 del self.ip_requests[ip]
 
         # Очищаем старые блокировки
         for ip in list(self.blocked_ips.keys()):
             if current_time - self.blocked_ips[ip] > self.block_duration:
                 del self.blocked_ips[ip]
+
+        # Счетчики блокировок по сетям считаются в пределах одного периода
+        # очистки, заблокированные сети сворачиваются
+        self._subnet_blocks.clear()
+        self.blocked_networks.prune(current_time)
@@ -272,14 +272,15 @@ class OpenAIService:
                 stream=True,
             )
 
-            collected_content = ""
+            # Собираем фрагменты в список и склеиваем один раз в конце
+            content_chunks: List[str] = []
             finish_reason = None
             chunk_count = 0
 
             async for chunk in stream:
                 chunk_count += 1
                 if chunk.choices and chunk.choices[0].delta.content:
-                    collected_content += chunk.choices[0].delta.content
+                    content_chunks.append(chunk.choices[0].delta.content)
 
                 if chunk.choices and chunk.choices[0].finish_reason:
                     finish_reason = chunk.choices[0].finish_reason
@@ -289,6 +290,8 @@ class OpenAIService:
                 f"OpenAI API stream completed in {process_time:.2f}s with {chunk_count} chunks"
             )
 
+            collected_content = "".join(content_chunks)
+
             # Очищаем собранный контент от markdown
             cleaned_content = self._clean_markdown(collected_content)
 
@@ -2,10 +2,14 @@
 Конфигурация для тестов.
 """
 
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+import httpx
 import pytest
-from unittest.mock import MagicMock, patch
+import pytest_asyncio
+from unittest.mock import patch
 from fastapi import FastAPI
-from fastapi.testclient import TestClient
 from fastapi.middleware.cors import CORSMiddleware
 
 from main import (
@@ -20,37 +24,53 @@ from main import (
 )
 from src.middleware.logging import RequestLoggingMiddleware
 
+try:
+    from httpx_aiohttp import AiohttpTransport
+except ImportError:
+    # httpx-aiohttp может отсутствовать, тогда остается транспорт httpx
+    AiohttpTransport = None
+
+# Пул соединений интеграционных клиентов, свой в каждом xdist воркере.
+# HTTP/2 согласуется только через TLS (ALPN) с h2-сервером; uvicorn
+# отдает HTTP/1.1, и тогда запросы идут через keep-alive соединения пула.
+CLIENT_LIMITS = httpx.Limits(
+    max_keepalive_connections=20, max_connections=100, keepalive_expiry=30.0
+)
+
+
+@dataclass(frozen=True, slots=True)
+class FakeSettings:
+    """Неизменяемые настройки для тестов."""
+
+    openai_api_key: str = "test-key"
+    gpt_model: str = "gpt-4o-mini"
+    enable_cache: bool = True
+    cache_ttl_seconds: int = 3600
+    allowed_origins: List[str] = field(
+        default_factory=lambda: ["http://localhost:3000"]
+    )
+    rate_limit_per_minute: int = 100
+    api_key: Optional[str] = None  # Отключаем аутентификацию для тестов
+    debug: bool = True
+    host: str = "localhost"
+    port: int = 8000
+    temperature: float = 0.7
+    max_tokens: int = 1000
+    system_prompt: str = "Test prompt"
+    max_history_messages: int = 10
+
 
 @pytest.fixture(autouse=True)
 def mock_settings():
     """Автоматический мок настроек для всех тестов."""
     with patch("main.get_settings") as mock_get_settings, \
-         patch("src.config.get_settings") as mock_config_settings, \
-         patch("src.middleware.auth.get_settings") as mock_auth_settings, \
-         patch("src.middleware.rate_limit.get_settings") as mock_rate_settings, \
-         patch("src.services.openai_service.get_settings") as mock_service_settings:
+         patch("src.config.get_settings") as mock_config_settings:
         
-        settings = MagicMock()
-        settings.openai_api_key = "test-key"
-        settings.gpt_model = "gpt-4o-mini"
-        settings.enable_cache = True
-        settings.cache_ttl_seconds = 3600
-        settings.allowed_origins = ["http://localhost:3000"]
-        settings.rate_limit_per_minute = 100
-        settings.api_key = None  # Отключаем аутентификацию для тестов
-        settings.debug = True
-        settings.host = "localhost"
-        settings.port = 8000
-        settings.temperature = 0.7
-        settings.max_tokens = 1000
-        settings.system_prompt = "Test prompt"
+        settings = FakeSettings()
         
         # Применяем мок ко всем местам, где используются настройки
         mock_get_settings.return_value = settings
         mock_config_settings.return_value = settings
-        mock_auth_settings.return_value = settings
-        mock_rate_settings.return_value = settings
-        mock_service_settings.return_value = settings
         
         yield settings
 
@@ -91,10 +111,61 @@ def test_app(mock_settings):
     return app
 
 
+@pytest.fixture(scope="session")
+def client():
+    """HTTP клиент с пулом соединений, общий для всей сессии."""
+    with httpx.Client(
+        base_url="http://localhost:8000",
+        limits=CLIENT_LIMITS,
+        http2=True,
+        timeout=30.0,
+    ) as client:
+        yield client
+
+
+@pytest_asyncio.fixture(scope="session", loop_scope="session")
+async def async_client():
+    """Асинхронный HTTP клиент с пулом соединений, общий для всей сессии.
+
+    При установленном httpx-aiohttp запросы идут через пул aiohttp,
+    который быстрее при большом числе конкурентных запросов; HTTP/2 в
+    этом транспорте не используется.
+    """
+    if AiohttpTransport is not None:
+        client = httpx.AsyncClient(
+            base_url="http://localhost:8000",
+            transport=AiohttpTransport(limits=CLIENT_LIMITS),
+            timeout=30.0,
+        )
+    else:
+        client = httpx.AsyncClient(
+            base_url="http://localhost:8000",
+            limits=CLIENT_LIMITS,
+            http2=True,
+            timeout=30.0,
+        )
+    yield client
+    await client.aclose()
+
+
+@pytest.fixture
+def anyio_backend():
+    """Асинхронные тесты выполняются только на asyncio."""
+    return "asyncio"
+
+
+@pytest.fixture
+def asgi_app(test_app):
+    """ASGI приложение для aclient; модули переопределяют фикстуру своим app."""
+    return test_app
+
+
 @pytest.fixture
-def client(test_app):
-    """Тестовый клиент FastAPI."""
-    return TestClient(test_app)
+async def aclient(asgi_app):
+    """Асинхронный тестовый клиент поверх ASGI приложения."""
+    transport = httpx.ASGITransport(app=asgi_app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as c:
+        yield c
 
 
 @pytest.fixture
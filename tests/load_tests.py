@@ -6,6 +6,32 @@ from locust import HttpUser, task, between
 import json
 import random
 
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+CHAT_MESSAGES = (
+    "Привет! Как дела?",
+    "Расскажи о погоде",
+    "Что ты умеешь?",
+    "Помоги с задачей",
+    "Объясни концепцию машинного обучения",
+)
+
+# Тела запросов сериализуются один раз при импорте, а не в каждой задаче
+CHAT_PAYLOADS = tuple(
+    json.dumps({"message": message, "user_id": f"test_user_{user_id}"}).encode()
+    for message in CHAT_MESSAGES
+    for user_id in range(1, 101)
+)
+
+HEAVY_PAYLOAD = json.dumps({
+    "text": "Это очень длинный текст для обработки. " * 100,
+    "options": {
+        "deep_analysis": True,
+        "generate_summary": True,
+        "extract_keywords": True
+    }
+}).encode()
+
 
 class OptimaAIUser(HttpUser):
     """Пользователь для нагрузочного тестирования OptimaAI Bot."""
@@ -47,24 +73,10 @@ class OptimaAIUser(HttpUser):
     @task(1)
     def chat_request(self):
         """Тестирование чат API."""
-        test_messages = [
-            "Привет! Как дела?",
-            "Расскажи о погоде",
-            "Что ты умеешь?",
-            "Помоги с задачей",
-            "Объясни концепцию машинного обучения"
-        ]
-        
-        message = random.choice(test_messages)
-        payload = {
-            "message": message,
-            "user_id": f"test_user_{random.randint(1, 100)}"
-        }
-        
         with self.client.post(
             "/api/chat",
-            json=payload,
-            headers={"Content-Type": "application/json"},
+            data=random.choice(CHAT_PAYLOADS),
+            headers=JSON_HEADERS,
             catch_response=True
         ) as response:
             if response.status_code == 200:
@@ -163,19 +175,10 @@ class HeavyUser(HttpUser):
     @task
     def heavy_processing(self):
         """Тяжелый запрос на обработку."""
-        payload = {
-            "text": "Это очень длинный текст для обработки. " * 100,
-            "options": {
-                "deep_analysis": True,
-                "generate_summary": True,
-                "extract_keywords": True
-            }
-        }
-        
         with self.client.post(
             "/api/process",
-            json=payload,
-            headers={"Content-Type": "application/json"},
+            data=HEAVY_PAYLOAD,
+            headers=JSON_HEADERS,
             catch_response=True,
             timeout=30  # Увеличенный таймаут для тяжелых запросов
         ) as response:
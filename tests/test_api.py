@@ -5,16 +5,17 @@
 from unittest.mock import MagicMock, patch
 
 import pytest
-from fastapi.testclient import TestClient
 
 from main import app
 from src.models.message import Message, MessageRole
 
+pytestmark = pytest.mark.anyio
+
 
 @pytest.fixture
-def client():
-    """Фикстура для тестового клиента."""
-    return TestClient(app)
+def asgi_app():
+    """Эндпоинты проверяются на полном приложении со всеми middleware."""
+    return app
 
 
 @pytest.fixture
@@ -33,9 +34,9 @@ def mock_settings():
         yield settings
 
 
-def test_health_endpoint(client, mock_settings):
+async def test_health_endpoint(aclient, mock_settings):
     """Тест эндпоинта проверки здоровья."""
-    response = client.get("/health")
+    response = await aclient.get("/health")
     assert response.status_code == 200
 
     data = response.json()
@@ -45,18 +46,18 @@ def test_health_endpoint(client, mock_settings):
     assert "timestamp" in data
 
 
-def test_chat_endpoint_validation(client, mock_settings):
+async def test_chat_endpoint_validation(aclient, mock_settings):
     """Тест валидации запроса к чату."""
     # Пустой запрос
-    response = client.post("/chat", json={})
+    response = await aclient.post("/chat", json={})
     assert response.status_code == 422
 
     # Неправильная структура сообщений
-    response = client.post("/chat", json={"messages": []})
+    response = await aclient.post("/chat", json={"messages": []})
     assert response.status_code == 422
 
     # Правильная структура
-    response = client.post(
+    response = await aclient.post(
         "/chat", json={"messages": [{"role": "user", "content": "Тестовое сообщение"}]}
     )
     # Может вернуть 500 из-за отсутствия реального OpenAI ключа
@@ -64,7 +65,7 @@ def test_chat_endpoint_validation(client, mock_settings):
 
 
 @patch("src.services.openai_service.OpenAIService")
-def test_chat_endpoint_success(mock_openai_service, client, mock_settings):
+async def test_chat_endpoint_success(mock_openai_service, aclient, mock_settings):
     """Тест успешного ответа от чата."""
     # Мокаем OpenAI сервис
     mock_service_instance = MagicMock()
@@ -85,7 +86,7 @@ def test_chat_endpoint_success(mock_openai_service, client, mock_settings):
 
     mock_service_instance.generate_response.return_value = mock_response
 
-    response = client.post(
+    response = await aclient.post(
         "/chat", json={"messages": [{"role": "user", "content": "Тестовое сообщение"}]}
     )
 
@@ -95,25 +96,25 @@ def test_chat_endpoint_success(mock_openai_service, client, mock_settings):
     assert data["message"]["content"] == "Тестовый ответ"
 
 
-def test_cache_endpoints(client, mock_settings):
+async def test_cache_endpoints(aclient, mock_settings):
     """Тест эндпоинтов кэша."""
     # Статистика кэша
-    response = client.get("/cache/stats")
+    response = await aclient.get("/cache/stats")
     # Может вернуть 404 если кэш не инициализирован
     assert response.status_code in [200, 404]
 
     # Очистка кэша
-    response = client.post("/cache/clear")
+    response = await aclient.post("/cache/clear")
     assert response.status_code in [200, 404]
 
     # Очистка устаревших записей
-    response = client.post("/cache/clear-expired")
+    response = await aclient.post("/cache/clear-expired")
     assert response.status_code in [200, 404]
 
 
-def test_metrics_endpoint(client, mock_settings):
+async def test_metrics_endpoint(aclient, mock_settings):
     """Тест эндпоинта метрик."""
-    response = client.get("/metrics")
+    response = await aclient.get("/metrics")
     assert response.status_code == 200
 
     data = response.json()
@@ -122,11 +123,11 @@ def test_metrics_endpoint(client, mock_settings):
     assert "timestamp" in data
 
 
-def test_rate_limiting(client, mock_settings):
+async def test_rate_limiting(aclient, mock_settings):
     """Тест rate limiting (базовый)."""
     # Делаем несколько запросов подряд
     for _ in range(5):
-        response = client.get("/health")
+        response = await aclient.get("/health")
         assert response.status_code == 200
 
         # Проверяем наличие заголовков rate limiting
@@ -134,10 +135,10 @@ def test_rate_limiting(client, mock_settings):
         assert "X-RateLimit-Remaining" in response.headers
 
 
-def test_cors_headers(client, mock_settings):
+async def test_cors_headers(aclient, mock_settings):
     """Тест CORS заголовков."""
     # Тестируем обычный GET запрос с Origin
-    response = client.get(
+    response = await aclient.get(
         "/health",
         headers={
             "Origin": "http://localhost:3000",
@@ -150,10 +151,10 @@ def test_cors_headers(client, mock_settings):
     assert "X-Content-Type-Options" in response.headers
 
 
-def test_error_handling(client, mock_settings):
+async def test_error_handling(aclient, mock_settings):
     """Тест обработки ошибок."""
     # Тест с некорректными данными
-    response = client.post(
+    response = await aclient.post(
         "/chat", json={"messages": [{"role": "invalid_role", "content": "Тест"}]}
     )
 
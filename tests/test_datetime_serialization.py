@@ -7,11 +7,12 @@ from datetime import datetime
 from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
-from fastapi.testclient import TestClient
 
-from main import DateTimeEncoder, app, create_json_response
+from main import DateTimeEncoder, create_json_response
 from src.models.message import Message, MessageResponse, MessageRole
 
+pytestmark = pytest.mark.anyio
+
 
 # Используем fixtures из conftest.py
 
@@ -51,9 +52,9 @@ def test_create_json_response():
     assert content["nested"]["created_at"] == "2023-12-25T16:00:00"
 
 
-def test_health_endpoint_datetime_serialization(client):
+async def test_health_endpoint_datetime_serialization(aclient):
     """Тест сериализации datetime в health endpoint."""
-    response = client.get("/health")
+    response = await aclient.get("/health")
     
     assert response.status_code == 200
     data = response.json()
@@ -66,9 +67,9 @@ def test_health_endpoint_datetime_serialization(client):
     assert "T" in timestamp  # ISO формат содержит T между датой и временем
 
 
-def test_metrics_endpoint_datetime_serialization(client):
+async def test_metrics_endpoint_datetime_serialization(aclient):
     """Тест сериализации datetime в metrics endpoint."""
-    response = client.get("/metrics")
+    response = await aclient.get("/metrics")
     
     assert response.status_code == 200
     data = response.json()
@@ -80,9 +81,9 @@ def test_metrics_endpoint_datetime_serialization(client):
     assert "T" in timestamp
 
 
-def test_security_status_datetime_serialization(client):
+async def test_security_status_datetime_serialization(aclient):
     """Тест сериализации datetime в security status endpoint."""
-    response = client.get("/security/status")
+    response = await aclient.get("/security/status")
     
     assert response.status_code == 200
     data = response.json()
@@ -94,10 +95,10 @@ def test_security_status_datetime_serialization(client):
     assert "T" in timestamp
 
 
-def test_error_response_datetime_serialization(client):
+async def test_error_response_datetime_serialization(aclient):
     """Тест сериализации datetime в error responses."""
     # Отправляем некорректный запрос для получения ошибки
-    response = client.post("/chat", json={})
+    response = await aclient.post("/chat", json={})
     
     assert response.status_code == 422
     data = response.json()
@@ -113,7 +114,7 @@ def test_error_response_datetime_serialization(client):
 
 
 @patch("main.OpenAIService")
-def test_chat_response_datetime_serialization(mock_openai_service, client):
+async def test_chat_response_datetime_serialization(mock_openai_service, aclient):
     """Тест сериализации datetime в chat response."""
     # Создаем настоящий объект MessageResponse
     test_message = Message(
@@ -139,7 +140,7 @@ def test_chat_response_datetime_serialization(mock_openai_service, client):
 
     
     # Отправляем корректный запрос
-    response = client.post("/chat", json={
+    response = await aclient.post("/chat", json={
         "messages": [
             {"role": "user", "content": "Hello"}
         ]
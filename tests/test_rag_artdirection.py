@@ -0,0 +1,72 @@
+"""
+Интеграционные тесты RAG системы для запросов про ArtDirection.
+
+Индекс загружается один раз на сессию, запросы к боту выполняются
+как отдельные параметризованные кейсы. Тесты обращаются к OpenAI API
+и по умолчанию исключены маркерами integration и slow; запуск:
+
+    pytest -m integration tests/test_rag_artdirection.py
+"""
+
+from pathlib import Path
+
+import pytest
+
+from src.rag.bot_interface import BotInterface
+from src.rag.rag_system import RAGSystem
+
+project_root = Path(__file__).parent.parent
+
+TEST_QUERIES = [
+    "Расскажи подробнее про ArtDirection",
+    "Сколько стоит курс ArtDirection?",
+    "Что входит в курс ArtDirection?",
+    "Сколько длится курс ArtDirection?",
+]
+
+pytestmark = [pytest.mark.integration, pytest.mark.slow]
+
+
+@pytest.fixture(scope="session")
+def rag_system():
+    """RAG система с индексом, загруженным один раз на сессию."""
+    rag_system = RAGSystem(
+        data_dir=str(project_root / "rag"),
+        persist_dir=str(project_root / "rag_index"),
+        chunk_size=1000,
+        chunk_overlap=200,
+    )
+    rag_system.load_and_index_documents(force_reload=False)
+    return rag_system
+
+
+@pytest.fixture(scope="session")
+def bot_interface(rag_system):
+    """Интерфейс бота поверх общей RAG системы."""
+    return BotInterface(
+        rag_system=rag_system,
+        model_name="gpt-4o-mini",
+        temperature=0.7,
+    )
+
+
+def test_document_search(rag_system):
+    """Тест поиска документов по запросу ArtDirection."""
+    results = rag_system.query("ArtDirection", k=4)
+
+    assert len(results) > 0
+    for doc in results:
+        assert doc.page_content
+
+
+@pytest.mark.parametrize("query", TEST_QUERIES)
+def test_art_direction_response(query, bot_interface):
+    """Тест ответа бота на запрос про ArtDirection."""
+    response = bot_interface.process_query(query, k=4)
+
+    assert isinstance(response, str)
+    assert len(response) > 0
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -3,21 +3,52 @@
 Проверяет security headers, SSL конфигурацию, rate limiting и DDoS защиту.
 """
 
+import select
+import socket
 import time
-from unittest.mock import MagicMock, patch
+from collections import deque
+from unittest.mock import AsyncMock, patch
 
+import httpx
 import pytest
-import requests
-from fastapi import Request
 from fastapi.testclient import TestClient
 
 from main import app
 from src.config import get_settings
 from src.middleware.security_headers import (
+    DEFAULT_CSP_POLICY,
+    DEFAULT_PERMISSIONS_POLICY,
     DDoSProtectionMiddleware,
+    IPTrie,
     SecurityHeadersMiddleware,
+    _ipv4_to_int,
 )
 
+pytestmark = pytest.mark.anyio
+
+
+async def _noop_app(scope, receive, send):
+    """Пустое ASGI приложение для юнит-тестов middleware."""
+
+
+@pytest.fixture
+def asgi_app():
+    """Заголовки проверяются на полном приложении со всеми middleware."""
+    return app
+
+
+@pytest.fixture(scope="module")
+def client():
+    """Тестовый клиент, общий для модуля: lifespan запускается один раз."""
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture(scope="module")
+def health_response(client):
+    """Ответ /health, общий для проверок заголовков."""
+    return client.get("/health")
+
 
 class TestSecurityHeaders:
     """Тесты для Security Headers Middleware."""
@@ -25,7 +56,7 @@ class TestSecurityHeaders:
     def test_security_headers_middleware_init(self):
         """Тест инициализации SecurityHeadersMiddleware."""
         middleware = SecurityHeadersMiddleware(
-            app=MagicMock(),
+            app=_noop_app,
             hsts_max_age=31536000,
             hsts_include_subdomains=True,
             hsts_preload=True,
@@ -34,50 +65,48 @@ class TestSecurityHeaders:
         assert middleware.hsts_max_age == 31536000
         assert middleware.hsts_include_subdomains is True
         assert middleware.hsts_preload is True
+        assert middleware.csp_policy is DEFAULT_CSP_POLICY
+        assert middleware.permissions_policy is DEFAULT_PERMISSIONS_POLICY
         assert "default-src 'self'" in middleware.csp_policy
         assert "geolocation=()" in middleware.permissions_policy
 
-    @pytest.mark.asyncio
-    async def test_security_headers_added(self):
-        """Тест добавления security headers."""
-        client = TestClient(app)
-
-        response = client.get("/health")
-
-        # Проверяем основные security headers
-        assert "X-Frame-Options" in response.headers
-        assert "X-Content-Type-Options" in response.headers
-        assert "X-XSS-Protection" in response.headers
-        assert "Referrer-Policy" in response.headers
-        assert "Content-Security-Policy" in response.headers
-        assert "Permissions-Policy" in response.headers
-        assert "X-Security-Headers" in response.headers
-
-        # Проверяем значения
-        assert response.headers["X-Frame-Options"] == "SAMEORIGIN"
-        assert response.headers["X-Content-Type-Options"] == "nosniff"
-        assert response.headers["X-XSS-Protection"] == "1; mode=block"
-        assert response.headers["X-Security-Headers"] == "enabled"
-
-    @pytest.mark.asyncio
-    async def test_hsts_header_https(self):
+    @pytest.mark.parametrize(
+        "name,expected",
+        [
+            ("X-Frame-Options", "SAMEORIGIN"),
+            ("X-Content-Type-Options", "nosniff"),
+            ("X-XSS-Protection", "1; mode=block"),
+            ("Referrer-Policy", None),
+            ("Content-Security-Policy", None),
+            ("Permissions-Policy", None),
+            ("X-Security-Headers", "enabled"),
+        ],
+    )
+    def test_security_header(self, health_response, name, expected):
+        """Тест добавления security header к ответу."""
+        assert name in health_response.headers
+        if expected:
+            assert health_response.headers[name] == expected
+
+    async def test_hsts_header_https(self, aclient):
         """Тест HSTS header для HTTPS запросов."""
-        # Мокаем HTTPS запрос
-        with patch("fastapi.Request") as mock_request:
-            mock_request.url.scheme = "https"
+        # Для HTTP запросов HSTS не добавляется
+        response = await aclient.get("/health")
+        assert "Strict-Transport-Security" not in response.headers
 
-            client = TestClient(app)
-            response = client.get("/health")
+        # ASGITransport берет схему из base_url, так что scope["scheme"] == "https"
+        async with httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app), base_url="https://test"
+        ) as https_client:
+            response = await https_client.get("/health")
 
-            # HSTS должен быть добавлен для HTTPS
-            # В реальном тесте нужно проверить через настоящий HTTPS сервер
+        hsts = response.headers["Strict-Transport-Security"]
+        assert "max-age=31536000" in hsts
+        assert "includeSubDomains" in hsts
 
-    @pytest.mark.asyncio
-    async def test_server_headers_removed(self):
+    async def test_server_headers_removed(self, aclient):
         """Тест удаления потенциально опасных заголовков."""
-        client = TestClient(app)
-
-        response = client.get("/health")
+        response = await aclient.get("/health")
 
         # Эти заголовки не должны присутствовать
         assert "Server" not in response.headers
@@ -90,7 +119,7 @@ class TestDDoSProtection:
     def test_ddos_middleware_init(self):
         """Тест инициализации DDoSProtectionMiddleware."""
         middleware = DDoSProtectionMiddleware(
-            app=MagicMock(),
+            app=_noop_app,
             max_connections_per_ip=10,
             suspicious_threshold=100,
             block_duration=300,
@@ -104,26 +133,38 @@ class TestDDoSProtection:
 
     def test_get_client_ip(self):
         """Тест получения IP клиента."""
-        middleware = DDoSProtectionMiddleware(app=MagicMock())
+        middleware = DDoSProtectionMiddleware(app=_noop_app)
 
-        # Мокаем запрос с X-Forwarded-For
-        mock_request = MagicMock()
-        mock_request.headers.get.side_effect = lambda header: {
-            "X-Forwarded-For": "192.168.1.100, 10.0.0.1",
-            "X-Real-IP": None,
-        }.get(header)
-        mock_request.client.host = "127.0.0.1"
+        # ASGI scope с X-Forwarded-For
+        scope = {
+            "type": "http",
+            "headers": [(b"x-forwarded-for", b"192.168.1.100, 10.0.0.1")],
+            "client": ("127.0.0.1", 12345),
+        }
 
-        ip = middleware._get_client_ip(mock_request)
+        ip = middleware._get_client_ip(scope)
         assert ip == "192.168.1.100"
 
+        # Без X-Forwarded-For используется X-Real-IP, затем адрес соединения
+        scope["headers"] = [(b"x-real-ip", b"10.0.0.5")]
+        assert middleware._get_client_ip(scope) == "10.0.0.5"
+
+        scope["headers"] = []
+        assert middleware._get_client_ip(scope) == "127.0.0.1"
+
+    def test_ipv4_to_int(self):
+        """Тест преобразования IPv4 адреса в число."""
+        assert _ipv4_to_int("192.168.1.100") == 0xC0A80164
+        assert _ipv4_to_int("::1") is None
+        assert _ipv4_to_int("unknown") is None
+
     def test_ip_blocking(self):
         """Тест блокировки IP адресов."""
-        middleware = DDoSProtectionMiddleware(app=MagicMock())
+        middleware = DDoSProtectionMiddleware(app=_noop_app)
         current_time = time.time()
 
         # Блокируем IP
-        middleware.blocked_ips["192.168.1.100"] = current_time
+        middleware._block_ip("192.168.1.100", current_time)
 
         # Проверяем блокировку
         assert middleware._is_ip_blocked("192.168.1.100", current_time) is True
@@ -134,9 +175,62 @@ class TestDDoSProtection:
         middleware.blocked_ips["192.168.1.100"] = old_time
         assert middleware._is_ip_blocked("192.168.1.100", current_time) is False
 
+    def test_subnet_blocking(self):
+        """Тест блокировки /24 сети после частых блокировок ее адресов."""
+        middleware = DDoSProtectionMiddleware(app=_noop_app, subnet_block_threshold=4)
+        current_time = time.time()
+
+        for host in range(1, 5):
+            middleware._block_ip(f"10.0.0.{host}", current_time)
+
+        # Вся сеть 10.0.0.0/24 заблокирована, соседняя сеть — нет
+        assert middleware._is_ip_blocked("10.0.0.200", current_time) is True
+        assert middleware._is_ip_blocked("10.0.1.200", current_time) is False
+
+        # После истечения блокировки сеть удаляется при очистке
+        expired = current_time + middleware.block_duration + 1
+        middleware._cleanup_old_records(expired)
+        assert middleware._is_ip_blocked("10.0.0.200", expired) is False
+        assert not middleware.blocked_networks
+
+    def test_subnet_blocking_threshold_one(self):
+        """Тест блокировки сети с первого же заблокированного адреса."""
+        middleware = DDoSProtectionMiddleware(app=_noop_app, subnet_block_threshold=1)
+        current_time = time.time()
+
+        middleware._block_ip("10.0.0.1", current_time)
+
+        assert middleware._is_ip_blocked("10.0.0.200", current_time) is True
+        assert not middleware._subnet_blocks
+
+        with pytest.raises(ValueError):
+            DDoSProtectionMiddleware(app=_noop_app, subnet_block_threshold=0)
+
+    def test_recently_blocked_cache(self):
+        """Тест LRU кэша адресов из заблокированных сетей."""
+        middleware = DDoSProtectionMiddleware(app=_noop_app)
+        current_time = time.time()
+
+        # Много точечных блокировок не мешают быстрому пути
+        for i in range(10000):
+            middleware.blocked_ips[f"172.16.{i >> 8}.{i & 0xff}"] = current_time
+        middleware.blocked_networks.insert(
+            _ipv4_to_int("10.0.0.0"), 24, current_time + middleware.block_duration
+        )
+
+        recent = [f"10.0.0.{host}" for host in range(16)]
+        for ip in recent:
+            assert middleware._is_ip_blocked(ip, current_time) is True
+        assert list(middleware._block_cache) == recent
+
+        # Повторные проверки отвечают из кэша, без обхода дерева
+        middleware.blocked_networks = IPTrie()
+        for ip in recent:
+            assert middleware._is_ip_blocked(ip, current_time) is True
+
     def test_rate_limiting(self):
         """Тест rate limiting."""
-        middleware = DDoSProtectionMiddleware(app=MagicMock(), suspicious_threshold=5)
+        middleware = DDoSProtectionMiddleware(app=_noop_app, suspicious_threshold=5)
         current_time = time.time()
 
         # Добавляем много запросов от одного IP
@@ -148,10 +242,62 @@ class TestDDoSProtection:
         assert middleware._check_rate_limits(ip, current_time) is True
         assert ip in middleware.blocked_ips
 
+    async def test_coarse_clock_started_on_request(self):
+        """Тест запуска грубых часов при первом запросе."""
+        middleware = DDoSProtectionMiddleware(
+            app=_noop_app, whitelist_ips=["127.0.0.1"]
+        )
+        middleware._current_time = 0.0
+        scope = {"type": "http", "headers": [], "client": ("127.0.0.1", 12345)}
+
+        await middleware(scope, AsyncMock(), AsyncMock())
+
+        assert middleware._ticker is not None
+        assert middleware._current_time > 0
+        middleware._ticker.cancel()
+        middleware._cleanup_task.cancel()
+
+    async def test_block_response_is_prebuilt(self):
+        """Тест готового ответа 429 для заблокированного IP."""
+        middleware = DDoSProtectionMiddleware(app=_noop_app)
+        middleware._block_ip("192.168.1.100", middleware._current_time)
+        scope = {
+            "type": "http",
+            "headers": [(b"x-real-ip", b"192.168.1.100")],
+            "client": ("127.0.0.1", 12345),
+        }
+        messages = []
+
+        async def send(message):
+            messages.append(message)
+
+        await middleware(scope, AsyncMock(), send)
+        middleware._ticker.cancel()
+        middleware._cleanup_task.cancel()
+
+        start, body = messages
+        assert start["status"] == 429
+        assert (b"retry-after", b"300") in start["headers"]
+        assert body["body"] is DDoSProtectionMiddleware._BLOCKED_BODY
+
+    def test_cleanup_loop_starts(self):
+        """Тест запуска фоновой очистки вместе с грубыми часами."""
+        middleware = DDoSProtectionMiddleware(app=_noop_app)
+
+        with patch(
+            "src.middleware.security_headers.asyncio.create_task"
+        ) as mock_create_task:
+            middleware._start_background_tasks()
+
+        coroutines = [call.args[0] for call in mock_create_task.call_args_list]
+        assert "_cleanup_loop" in [coro.__name__ for coro in coroutines]
+        for coro in coroutines:
+            coro.close()
+
     def test_whitelist_bypass(self):
         """Тест обхода ограничений для whitelist IP."""
         middleware = DDoSProtectionMiddleware(
-            app=MagicMock(), whitelist_ips=["127.0.0.1"]
+            app=_noop_app, whitelist_ips={"127.0.0.1"}
         )
 
         # Whitelist IP не должен блокироваться
@@ -161,15 +307,34 @@ class TestDDoSProtection:
 
         assert middleware._check_rate_limits("127.0.0.1", current_time) is False
 
+    def test_whitelist_cidr(self):
+        """Тест whitelist для целой сети в нотации CIDR."""
+        middleware = DDoSProtectionMiddleware(
+            app=_noop_app, suspicious_threshold=5, whitelist_ips=["192.168.0.0/16"]
+        )
+        current_time = time.time()
+
+        for _ in range(1000):
+            middleware._update_counters("192.168.10.20", current_time)
+            middleware._update_counters("10.0.0.1", current_time)
+
+        assert middleware._check_rate_limits("192.168.10.20", current_time) is False
+        assert "192.168.10.20" not in middleware.blocked_ips
+        assert middleware._check_rate_limits("10.0.0.1", current_time) is True
+
+        # Одиночная строка не разбивается на символы, а отклоняется
+        with pytest.raises(TypeError):
+            DDoSProtectionMiddleware(app=_noop_app, whitelist_ips="127.0.0.1")
+
     def test_cleanup_old_records(self):
         """Тест очистки старых записей."""
-        middleware = DDoSProtectionMiddleware(app=MagicMock())
+        middleware = DDoSProtectionMiddleware(app=_noop_app)
         current_time = time.time()
         old_time = current_time - 7200  # 2 часа назад
 
         # Добавляем старые записи
-        middleware.ip_requests["192.168.1.100"] = [old_time, old_time + 10]
-        middleware.ip_requests["192.168.1.101"] = [current_time - 10]
+        middleware.ip_requests["192.168.1.100"] = deque([old_time, old_time + 10])
+        middleware.ip_requests["192.168.1.101"] = deque([current_time - 10])
         middleware.blocked_ips["192.168.1.102"] = old_time
 
         # Очищаем
@@ -180,14 +345,29 @@ class TestDDoSProtection:
         assert "192.168.1.101" in middleware.ip_requests
         assert "192.168.1.102" not in middleware.blocked_ips
 
+    def test_cleanup_scales_to_100k(self):
+        """Тест очистки 100 тысяч IP в пределах бюджета времени."""
+        middleware = DDoSProtectionMiddleware(app=_noop_app)
+        current_time = time.time()
+        old_time = current_time - 7200
+
+        for i in range(100_000):
+            ip = f"10.{(i >> 16) & 0xff}.{(i >> 8) & 0xff}.{i & 0xff}"
+            middleware.ip_requests[ip] = deque([old_time])
+
+        start = time.perf_counter()
+        middleware._cleanup_old_records(current_time)
+        elapsed = time.perf_counter() - start
+
+        assert len(middleware.ip_requests) == 0
+        assert elapsed < 0.2, f"Cleanup of 100k IPs took {elapsed:.3f}s"
+
 
 class TestAPISecurityIntegration:
     """Интеграционные тесты безопасности API."""
 
-    def test_api_requires_authentication(self):
+    def test_api_requires_authentication(self, client):
         """Тест требования аутентификации для API."""
-        client = TestClient(app)
-
         # Запрос без API ключа должен быть отклонен
         response = client.post(
             "/chat", json={"messages": [{"role": "user", "content": "test"}]}
@@ -195,10 +375,8 @@ class TestAPISecurityIntegration:
 
         assert response.status_code == 401
 
-    def test_cors_headers_present(self):
+    def test_cors_headers_present(self, client):
         """Тест наличия CORS заголовков."""
-        client = TestClient(app)
-
         response = client.options("/health")
 
         # Проверяем CORS заголовки
@@ -206,19 +384,15 @@ class TestAPISecurityIntegration:
         assert "Access-Control-Allow-Methods" in response.headers
         assert "Access-Control-Allow-Headers" in response.headers
 
-    def test_health_endpoint_public(self):
+    def test_health_endpoint_public(self, client):
         """Тест доступности health endpoint без аутентификации."""
-        client = TestClient(app)
-
         response = client.get("/health")
 
         assert response.status_code == 200
         assert response.json()["status"] == "ok"
 
-    def test_security_status_endpoint(self):
+    def test_security_status_endpoint(self, client):
         """Тест endpoint статуса безопасности."""
-        client = TestClient(app)
-
         response = client.get("/security/status")
 
         assert response.status_code == 200
@@ -229,10 +403,8 @@ class TestAPISecurityIntegration:
         assert "features" in data
         assert "timestamp" in data
 
-    def test_rate_limiting_integration(self):
+    def test_rate_limiting_integration(self, client):
         """Тест интеграции rate limiting."""
-        client = TestClient(app)
-
         # Делаем много запросов подряд
         responses = []
         for _ in range(10):
@@ -249,6 +421,8 @@ class TestSSLConfiguration:
     @pytest.mark.skip(reason="Требует настроенный HTTPS сервер")
     def test_ssl_certificate_valid(self):
         """Тест валидности SSL сертификата."""
+        import requests
+
         # Этот тест требует реального HTTPS сервера
         url = "https://localhost:443/health"
 
@@ -261,6 +435,8 @@ class TestSSLConfiguration:
     @pytest.mark.skip(reason="Требует настроенный HTTPS сервер")
     def test_hsts_header_in_response(self):
         """Тест наличия HSTS заголовка в HTTPS ответе."""
+        import requests
+
         url = "https://localhost:443/health"
 
         try:
@@ -276,6 +452,8 @@ class TestSSLConfiguration:
     @pytest.mark.skip(reason="Требует настроенный HTTPS сервер")
     def test_http_redirect_to_https(self):
         """Тест редиректа с HTTP на HTTPS."""
+        import requests
+
         url = "http://localhost:80/health"
 
         try:
@@ -286,39 +464,52 @@ class TestSSLConfiguration:
             pytest.skip("HTTP server not available")
 
 
+def _scan_ports(ports, host="localhost", timeout=1.0):
+    """Проверяет доступность портов одним select по неблокирующим сокетам."""
+    address = socket.gethostbyname(host)
+    sockets = {}
+    try:
+        for port in ports:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setblocking(False)
+            sockets[sock] = port
+            sock.connect_ex((address, port))
+
+        # Сокет становится доступен на запись и при отказе в соединении,
+        # поэтому результат подключения берем из SO_ERROR
+        _, writable, _ = select.select([], list(sockets), [], timeout)
+        return {
+            port: sock in writable
+            and sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) == 0
+            for sock, port in sockets.items()
+        }
+    finally:
+        for sock in sockets:
+            sock.close()
+
+
 class TestFirewallConfiguration:
     """Тесты конфигурации firewall (требуют системных прав)."""
 
     @pytest.mark.skip(reason="Требует системные права")
     def test_firewall_blocks_unauthorized_ports(self):
         """Тест блокировки неавторизованных портов."""
-        import socket
-
         # Тестируем заблокированные порты
         blocked_ports = [23, 135, 139, 445]
 
-        for port in blocked_ports:
-            with pytest.raises(socket.error):
-                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                sock.settimeout(1)
-                result = sock.connect_ex(("localhost", port))
-                sock.close()
-                assert result != 0  # Соединение должно быть отклонено
+        results = _scan_ports(blocked_ports)
+
+        # Соединение должно быть отклонено
+        assert not any(results.values()), f"Open ports: {results}"
 
     @pytest.mark.skip(reason="Требует системные права")
     def test_firewall_allows_authorized_ports(self):
         """Тест разрешения авторизованных портов."""
-        import socket
-
         # Тестируем разрешенные порты
         allowed_ports = [80, 443, 8000]
 
-        for port in allowed_ports:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(1)
-            result = sock.connect_ex(("localhost", port))
-            sock.close()
-            # Порт должен быть доступен (или сервис не запущен, что тоже ок)
+        _scan_ports(allowed_ports)
+        # Порт должен быть доступен (или сервис не запущен, что тоже ок)
 
 
 class TestSecurityConfiguration:
@@ -351,6 +542,10 @@ class TestSecurityConfiguration:
         for origin in settings.allowed_origins:
             assert origin != "*"
 
+    def test_settings_are_cached(self):
+        """Тест кэширования настроек: Settings создается один раз."""
+        assert get_settings() is get_settings()
+
     def test_rate_limiting_configured(self):
         """Тест настройки rate limiting."""
         settings = get_settings()